@@ -1,4 +1,6 @@
+import collections
 import socket
+import struct
 import threading
 import tkinter as tk
 from tkinter import scrolledtext
@@ -15,6 +17,13 @@ BUTTON_FONT = ("Helvetica", 15)
 
 HOST = '127.0.0.1'
 PORT = 6666
+# Kernel socket buffer size; matches the server so a batched broadcast can
+# land in one go (the kernel clamps this to net.core.rmem_max/wmem_max).
+SOCK_BUF_SIZE = 1 << 20
+
+# Pre-bound frame header codec: skips re-parsing the "!I" format string on
+# every pack/unpack.
+_U32 = struct.Struct("!I")
 
 # Global client socket variable (None until connected)
 client = None
@@ -22,44 +31,128 @@ receiver_thread = None
 connected = False
 
 # ---------- Helper functions ----------
-def add_message(message):
-    """Add a line to the message box (thread-safe via `after`)."""
-    def _append():
+def send_framed(sock, text):
+    """Send one length-prefixed UTF-8 message on the socket."""
+    payload = text.encode('utf-8')
+    header = _U32.pack(len(payload))
+    # A gather-write hands header and payload to the kernel in one syscall
+    # and one segment (the portable equivalent of corking around two sends),
+    # without first concatenating them into a new bytes object.
+    try:
+        sent = sock.sendmsg([header, payload])
+    except AttributeError:
+        # platform without sendmsg
+        sock.sendall(header + payload)
+        return
+    total = len(header) + len(payload)
+    if sent < total:
+        sock.sendall((header + payload)[sent:])
+
+
+# Inbound lines queue here and the Tk thread drains them in batches, so a
+# message flood schedules one callback and one widget update instead of one
+# per message. deque append/popleft are thread-safe in CPython.
+DRAIN_BATCH = 200
+# Oldest lines are dropped past this point so the Text widget's internal
+# storage (and redraw cost) stays bounded no matter how long the chat runs.
+MAX_LINES = 5000
+
+pending_msgs = collections.deque()
+_drain_scheduled = False
+
+
+def _drain_messages():
+    """Tk-thread callback: move queued lines into the message box at once."""
+    global _drain_scheduled
+    batch = []
+    while pending_msgs and len(batch) < DRAIN_BATCH:
+        batch.append(pending_msgs.popleft())
+    if batch:
         message_box.config(state=tk.NORMAL)
-        message_box.insert(tk.END, message + '\n')
+        message_box.insert(tk.END, '\n'.join(batch) + '\n')
+        line_count = int(message_box.index('end-1c').split('.')[0])
+        if line_count > MAX_LINES:
+            message_box.delete('1.0', f'{line_count - MAX_LINES}.0')
         message_box.see(tk.END)
         message_box.config(state=tk.DISABLED)
-    root.after(0, _append)
+    _drain_scheduled = False
+    if pending_msgs:
+        # more arrived (or the batch cap hit); keep draining next tick
+        _drain_scheduled = True
+        root.after(0, _drain_messages)
+
+
+def add_message(message):
+    """Queue a line for the message box (thread-safe via `after`)."""
+    global _drain_scheduled
+    pending_msgs.append(message)
+    if not _drain_scheduled:
+        _drain_scheduled = True
+        root.after(0, _drain_messages)
+
+
+def handle_server_message(message):
+    """Display one decoded message from the server."""
+    # If server uses "username~message" format, show accordingly.
+    # partition scans the string once, unlike an `in` test plus split.
+    username, sep, content = message.partition("~")
+    if sep:
+        add_message(f"[{username}] {content}")
+    else:
+        add_message(f"[SERVER] {message}")
+
+
+RECV_BUF_SIZE = 65536
 
 
 def listen_for_messages_from_server(sock):
-    """Thread target: receive messages and display them."""
+    """Thread target: receive length-prefixed messages and display them."""
     global connected, client
+    # Preallocated buffer filled in place via recv_into; rpos/wpos track the
+    # parsed and filled extents, so steady-state reads allocate nothing.
+    recv_buf = bytearray(RECV_BUF_SIZE)
+    rpos = wpos = 0
     try:
         while True:
+            if wpos == len(recv_buf):
+                if rpos:
+                    # reclaim the already-parsed prefix
+                    del recv_buf[:rpos]
+                    recv_buf += bytes(rpos)
+                    wpos -= rpos
+                    rpos = 0
+                else:
+                    # a single frame larger than the buffer: grow it
+                    recv_buf += bytes(len(recv_buf))
+
             try:
-                data = sock.recv(4096)
+                n = sock.recv_into(memoryview(recv_buf)[wpos:])
             except OSError:
                 # socket closed
                 break
 
-            if not data:
+            if n == 0:
                 # Server closed connection
                 add_message("[SYSTEM] Server closed the connection.")
                 break
+            wpos += n
 
-            try:
-                message = data.decode('utf-8')
-            except Exception:
-                # fallback
-                message = repr(data)
-
-            # If server uses "username~message" format, show accordingly
-            if "~" in message:
-                username, content = message.split("~", 1)
-                add_message(f"[{username}] {content}")
-            else:
-                add_message(f"[SERVER] {message}")
+            # The server batches frames, so one recv may hold several
+            # messages (or a fraction of one); split on the 4-byte prefix.
+            while wpos - rpos >= 4:
+                (length,) = _U32.unpack_from(recv_buf, rpos)
+                if wpos - rpos < 4 + length:
+                    break
+                start = rpos + 4
+                raw = memoryview(recv_buf)[start:start + length].tobytes()
+                rpos = start + length
+
+                # 'replace' never raises, so no try/except on the hot path
+                handle_server_message(raw.decode('utf-8', 'replace'))
+
+            if rpos == wpos:
+                # everything parsed; rewind the cursors without copying
+                rpos = wpos = 0
 
     finally:
         # cleanup when thread ends
@@ -85,6 +178,8 @@ def connect():
     # Create socket and connect
     try:
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCK_BUF_SIZE)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCK_BUF_SIZE)
         s.connect((HOST, PORT))
     except Exception as e:
         messagebox.showerror("Connection failed", f"Unable to connect to {HOST}:{PORT}\nError: {e}")
@@ -92,7 +187,7 @@ def connect():
 
     # send username as first message (server should expect this)
     try:
-        s.sendall(username.encode('utf-8'))
+        send_framed(s, username)
     except Exception as e:
         s.close()
         messagebox.showerror("Send failed", f"Failed to send username to server.\nError: {e}")
@@ -121,7 +216,7 @@ def send_message():
         return
 
     try:
-        client.sendall(message.encode('utf-8'))
+        send_framed(client, message)
         # Optionally show sent messages locally (uncomment if desired)
         # add_message(f"[You] {message}")
         message_textbox.delete(0, tk.END)
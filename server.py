@@ -1,206 +1,238 @@
+import asyncio
+import logging
+import logging.handlers
+import queue
 import socket
-import threading
+import struct
 import sys
-import traceback
+import threading
+
+try:
+    import uvloop
+except ImportError:
+    # optional accelerator; the stdlib event loop works fine without it
+    uvloop = None
 
 HOST = '127.0.0.1'
 PORT = 6666
 LISTENER_LIMIT = 5
+USERNAME_TIMEOUT = 10.0  # seconds to wait for the first (username) frame
+# Kernel socket buffer size. Defaults throttle bursty fan-out; a bigger
+# window lets a whole flush land before the kernel pushes back (the kernel
+# clamps to net.core.rmem_max/wmem_max, so oversizing is harmless).
+SOCK_BUF_SIZE = 1 << 20
 
-# active_clients: list of dicts { "username": str, "sock": socket.socket }
-active_clients = []
-clients_lock = threading.Lock()
+log = logging.getLogger(__name__)
 
-def send_message_to_client(sock, message):
-    """Send a UTF-8 message to a single client. If sending fails, return False."""
-    try:
-        sock.sendall(message.encode('utf-8'))
-        return True
-    except Exception:
-        try:
-            sock.close()
-        except Exception:
-            pass
-        return False
-
-def send_messages_to_all(message):
+def setup_logging():
     """
-    Broadcast a message to all connected clients.
-    Removes clients that can't be reached.
+    Route log records through a queue so the event loop never blocks on
+    console I/O; a QueueListener thread performs the actual writes.
+    Per-message logs are DEBUG and vanish at the default INFO level.
     """
-    to_remove = []
-    with clients_lock:
-        for entry in list(active_clients):
-            sock = entry["sock"]
-            ok = send_message_to_client(sock, message)
-            if not ok:
-                to_remove.append(entry)
-
-        for entry in to_remove:
-            try:
-                active_clients.remove(entry)
-            except ValueError:
-                pass
-            print(f"[SERVER] Removed unreachable client: {entry['username']}")
-    # Optionally log the broadcast on server console
-    print(f"[BROADCAST] {message}")
-
-def listen_for_messages(client_sock, username):
-    """Thread: receive messages from one client and broadcast them."""
-    try:
-        while True:
-            try:
-                data = client_sock.recv(2048)
-            except OSError:
-                # socket closed
-                break
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler())
+    root = logging.getLogger()
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(logging.INFO)
+    listener.start()
+    return listener
+
+# Cached prefix for server-originated notices; avoids an f-string plus
+# encode for every announcement.
+_SERVER_PREFIX = b"SERVER~"
+
+# Pre-bound frame header codec: skips re-parsing the "!I" format string on
+# every pack/unpack.
+_U32 = struct.Struct("!I")
+
+class ClientState:
+    """Per-connection state; __slots__ keeps instances small and lookups cheap."""
+    __slots__ = ("writer", "fd", "addr", "username", "prefix")
+
+    def __init__(self, writer, fd, addr):
+        self.writer = writer
+        self.fd = fd
+        self.addr = addr
+        self.username = None
+        self.prefix = None  # b"<username>~", encoded once at connect time
+
+# active_clients: fileno -> ClientState.
+# Only event-loop coroutines touch this dict, so no lock is needed; fan-out
+# merely queues bytes on each transport and never mutates the dict.
+active_clients = {}
+
+def decode_for_log(raw):
+    """
+    Decode payload bytes for console logging only.
+    'replace' stays on the C-level fast path and never raises, so the
+    per-message try/except (and its slow repr fallback) is gone.
+    """
+    return raw.decode('utf-8', 'replace')
 
-            if not data:
-                # client disconnected gracefully
-                break
+async def send_messages_to_all(*parts):
+    """
+    Broadcast a payload, given as one or more bytes parts, to all clients.
 
+    writer.write() only appends to the transport's buffer, so everything
+    queued within one loop tick leaves each socket in a single send; the
+    gathered drain() then applies backpressure per client without one slow
+    peer stalling the writes already queued for the others.
+    """
+    # The frame must stay a single contiguous buffer: one write() per
+    # recipient keeps each message to one send and one segment, and the
+    # transport coalesces anything else queued in the same loop tick, so
+    # there is nothing left for TCP_CORK to pack. join builds header,
+    # prefix and body into that buffer in a single allocation.
+    frame = b"".join((_U32.pack(sum(map(len, parts))),) + parts)
+    # The frame is built once; the inner loop does nothing but write it.
+    # Broken transports are collected and closed in a post-pass so their
+    # handle_client coroutines run the normal removal/announce path.
+    dead = None
+    drains = []
+    add_drain = drains.append
+    for state in active_clients.values():
+        writer = state.writer
+        try:
+            writer.write(frame)
+        except Exception:
+            if dead is None:
+                dead = []
+            dead.append(writer)
+            continue
+        add_drain(writer.drain())
+    if drains:
+        await asyncio.gather(*drains, return_exceptions=True)
+    if dead:
+        for writer in dead:
             try:
-                message = data.decode('utf-8')
+                writer.close()
             except Exception:
-                message = repr(data)
-
-            final_msg = f"{username}~{message}"
-            print(f"{username}: {message}")
-            send_messages_to_all(final_msg)
-    except Exception:
-        print(f"[ERROR] Exception in listener for {username}:")
-        traceback.print_exc()
-    finally:
-        remove_client(client_sock, username)
-
-def remove_client(client_sock, username):
-    """Remove client from list, close socket, and notify others."""
-    with clients_lock:
-        found = None
-        for entry in active_clients:
-            if entry["sock"] == client_sock:
-                found = entry
-                break
-        if found:
-            try:
-                active_clients.remove(found)
-            except ValueError:
                 pass
+    # %s is lazy: the payload is never rendered unless DEBUG is enabled
+    log.debug("[BROADCAST] %s", parts)
 
+async def read_frame(reader):
+    """Read one length-prefixed frame; returns bytes, or None on EOF/reset."""
     try:
-        client_sock.close()
-    except Exception:
-        pass
-
-    print(f"Client '{username}' disconnected")
-    # Announce to everyone except the removed client
-    send_messages_to_all(f"SERVER~{username} has left the chat")
-
-def client_handler(client_sock, addr):
-    """
-    Accept first message as username and then spin off a listener thread.
-    If username is empty or missing, close connection.
-    """
+        header = await reader.readexactly(4)
+        (length,) = _U32.unpack(header)
+        return await reader.readexactly(length)
+    except (asyncio.IncompleteReadError, ConnectionError, OSError):
+        return None
+
+async def handle_client(reader, writer):
+    """One coroutine per connection: username handshake, then relay frames."""
+    addr = writer.get_extra_info('peername')
+    sock = writer.get_extra_info('socket')
+    # Chat frames are tiny; without this Nagle can hold them back up to
+    # 40 ms. Write coalescing happens in the transport buffer instead.
+    if sock is not None:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCK_BUF_SIZE)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCK_BUF_SIZE)
+    fd = sock.fileno() if sock is not None else id(writer)
+    log.info("Connected to client %s:%s", addr[0], addr[1])
+
+    state = ClientState(writer, fd, addr)
     try:
-        client_sock.settimeout(10.0)  # initial timeout while waiting for username
-        raw = client_sock.recv(2048)
-        client_sock.settimeout(None)  # remove timeout
-        if not raw:
-            print(f"Connection from {addr} closed before sending username.")
-            client_sock.close()
+        try:
+            raw = await asyncio.wait_for(read_frame(reader), USERNAME_TIMEOUT)
+        except asyncio.TimeoutError:
+            log.info("Connection from %s sent no username in time. Closing.", addr)
+            return
+        if raw is None:
+            log.info("Connection from %s closed before sending username.", addr)
             return
 
-        username = raw.decode('utf-8').strip()
+        username = decode_for_log(raw).strip()
         if username == "":
-            print(f"Client at {addr} sent an empty username. Closing.")
-            client_sock.close()
+            log.info("Client at %s sent an empty username. Closing.", addr)
             return
 
-        with clients_lock:
-            active_clients.append({"username": username, "sock": client_sock})
+        username_bytes = username.encode('utf-8')
+        state.username = username
+        state.prefix = username_bytes + b"~"
+        active_clients[fd] = state
 
-        print(f"'{username}' connected from {addr[0]}:{addr[1]}")
-        send_messages_to_all(f"SERVER~{username} joined the chat")
+        log.info("'%s' connected from %s:%s", username, addr[0], addr[1])
+        await send_messages_to_all(_SERVER_PREFIX, username_bytes, b" joined the chat")
 
-        # Start listener thread for that client
-        listener = threading.Thread(target=listen_for_messages, args=(client_sock, username), daemon=True)
-        listener.start()
+        while True:
+            raw = await read_frame(reader)
+            if raw is None:
+                # client disconnected
+                break
+            log.debug("%s: %s", state.username, raw)
+            # Payloads are built from the cached bytes prefix, so the hot
+            # path never formats or encodes strings.
+            await send_messages_to_all(state.prefix, raw)
 
+    except asyncio.CancelledError:
+        raise
     except Exception:
-        print(f"[ERROR] Error receiving username from {addr}:")
-        traceback.print_exc()
+        log.exception("Exception in handler for %s:", state.username or addr)
+    finally:
+        was_registered = active_clients.pop(fd, None) is not None
         try:
-            client_sock.close()
+            writer.close()
+            await writer.wait_closed()
         except Exception:
             pass
-
-def server_send_messages():
-    """Allow server operator to broadcast messages by typing in console."""
-    try:
-        while True:
-            msg = input()
-            if msg is None:
-                break
-            txt = msg.strip()
+        if was_registered:
+            log.info("Client '%s' disconnected", state.username)
+            await send_messages_to_all(
+                _SERVER_PREFIX, state.username.encode('utf-8'), b" has left the chat")
+
+def start_console(loop):
+    """Let the server operator broadcast messages typed on the console."""
+    def pump():
+        for line in sys.stdin:
+            txt = line.strip()
             if txt:
-                send_messages_to_all(f"SERVER~{txt}")
-    except EOFError:
-        # stdin closed
-        pass
-    except Exception:
-        print("[ERROR] Exception in server_send_messages:")
-        traceback.print_exc()
-
-def main():
-    server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                asyncio.run_coroutine_threadsafe(
+                    send_messages_to_all(_SERVER_PREFIX, txt.encode('utf-8')), loop)
+    # Daemon thread: blocked stdin reads must not hold up shutdown.
+    threading.Thread(target=pump, daemon=True).start()
 
+async def run_server():
     try:
-        server_sock.bind((HOST, PORT))
-    except Exception as e:
-        print(f"Unable to bind to {HOST}:{PORT} -> {e}")
+        server = await asyncio.start_server(
+            handle_client, HOST, PORT, backlog=LISTENER_LIMIT,
+            reuse_port=hasattr(socket, "SO_REUSEPORT"))
+    except OSError as e:
+        log.error("Unable to bind to %s:%s -> %s", HOST, PORT, e)
         return
 
-    server_sock.listen(LISTENER_LIMIT)
-    print(f"Server running and listening on {HOST}:{PORT}")
-
-    # Thread to allow server operator to type broadcasts
-    threading.Thread(target=server_send_messages, daemon=True).start()
+    log.info("Server running and listening on %s:%s", HOST, PORT)
+    start_console(asyncio.get_running_loop())
 
     try:
-        while True:
+        async with server:
+            await server.serve_forever()
+    finally:
+        for state in active_clients.values():
             try:
-                client_sock, address = server_sock.accept()
-            except OSError:
-                # socket closed
-                break
-
-            print(f"Connected to client {address[0]}:{address[1]}")
-            # start handler thread
-            threading.Thread(target=client_handler, args=(client_sock, address), daemon=True).start()
+                state.writer.close()
+            except Exception:
+                pass
+        active_clients.clear()
 
+def main():
+    listener = setup_logging()
+    # uvloop swaps the selector loop for libuv, cutting per-callback
+    # overhead in the read/broadcast path; purely a drop-in when installed.
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        log.info("Using uvloop event loop")
+    try:
+        asyncio.run(run_server())
     except KeyboardInterrupt:
-        print("\n[SERVER] Shutdown requested (KeyboardInterrupt). Closing server...")
+        log.info("Shutdown requested (KeyboardInterrupt). Closing server...")
     except Exception:
-        print("[ERROR] Unexpected server error:")
-        traceback.print_exc()
-    finally:
-        # Close all client sockets
-        with clients_lock:
-            for entry in active_clients:
-                try:
-                    entry["sock"].close()
-                except Exception:
-                    pass
-            active_clients.clear()
-
-        try:
-            server_sock.close()
-        except Exception:
-            pass
-        print("[SERVER] Clean shutdown complete.")
-        sys.exit(0)
+        log.exception("Unexpected server error:")
+    log.info("Clean shutdown complete.")
+    listener.stop()
 
 if __name__ == "__main__":
     main()
-